@@ -1,22 +1,309 @@
 import os
 import shutil
 import re
-from glob import glob
+import hashlib
+import http.client
+import json
+import pickle
+import subprocess
+import time
 from datetime import datetime
-from collections import defaultdict
+from collections import ChainMap
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import heapq
 import itertools
-import logging
+import operator
 
-from tqdm.auto import tqdm
-import pandoc
-from pandoc.types import *
-from yatl import XML, render
+try:
+    # optional. C json encoder for the pandoc server payloads
+    import orjson
+except ImportError:
+    orjson = None
+
+from yatl import XML, render, xmlescape
 
 from defaultlog import log
 
-log = logging.getLogger(__name__)
 
-is_pandoc = lambda x: os.path.splitext(x)[-1] in pandoc._ext_to_file_format.keys()
+pandoc = None
+
+# AST containers whose metadata is a single wrapped value. filled by load_pandoc.
+meta_containers = ()
+
+
+def load_pandoc():
+    """ import the pandoc binding on first use. importing it builds the whole
+    AST class hierarchy, which module import and warm runs need not pay for """
+    global pandoc, meta_containers
+    if pandoc is None:
+        global Pandoc, Meta, MetaMap, MetaInlines, MetaValue, Para, Str, Space
+        import pandoc
+        from pandoc.types import (
+            Pandoc,
+            Meta,
+            MetaMap,
+            MetaInlines,
+            MetaValue,
+            Para,
+            Str,
+            Space,
+        )
+
+        meta_containers = (Pandoc, Meta, MetaMap)
+    return pandoc
+
+
+@lru_cache(maxsize=None)
+def pandoc_exts():
+    """ extensions pandoc can read, frozen once rather than rebuilt per file """
+    return frozenset(load_pandoc()._ext_to_file_format)
+
+
+is_pandoc = lambda x: os.path.splitext(x)[-1] in pandoc_exts()
+
+# compiled once rather than per page
+date_title_re = re.compile(r"^(?:(\d\d\d\d-\d\d-\d\d)-)?(.+)$")
+
+weekdays = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+months = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+@lru_cache(maxsize=2048)
+def rfc_2822(date):
+    """ format YYYY-MM-DD as an rfc 2822 date. avoids strptime/strftime, which
+    re-parse the format string per call and depend on locale. cached since
+    publish dates repeat across pages """
+    y, m, d = int(date[:4]), int(date[5:7]), int(date[8:10])
+    return f"{weekdays[datetime(y, m, d).weekday()]}, {d:02d} {months[m - 1]} {y} 00:00:00 +0000"
+
+
+@lru_cache(maxsize=4096)
+def mtime_date(ts):
+    """ YYYY-MM-DD for an mtime, cached on whole seconds so dates repeat """
+    return datetime.fromtimestamp(ts).strftime("%Y-%m-%d")
+
+
+cachedir = ".makesite_cache"
+
+
+def walk_content(root):
+    """ yield a DirEntry for every file under root. DirEntry caches the stat
+    from the directory read so this halves the syscalls of glob + isfile.
+    entries are sorted so traversal order is deterministic """
+    for entry in sorted(os.scandir(root), key=lambda e: e.name):
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk_content(entry.path)
+        else:
+            yield entry
+
+
+class PandocServer:
+    """ long running pandoc server. amortizes pandoc startup (~35ms per subprocess)
+    across all conversions. requires pandoc built with server support; callers
+    fall back to one subprocess per conversion when start() fails.
+    """
+
+    def __init__(self, port=3030):
+        self.port = port
+        self.proc = None
+        self.conn = None
+        self.pid = None
+
+    def start(self):
+        try:
+            self.proc = subprocess.Popen(
+                ["pandoc", "server", f"--port={self.port}"],
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError:
+            return False
+        # wait for the server to come up
+        for _ in range(50):
+            if self.proc.poll() is not None:
+                return False
+            try:
+                self.convert("", "markdown", "html")
+                return True
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        return False
+
+    def connection(self):
+        """ one keep-alive connection per process. workers forked from main
+        must not reuse the parent's socket """
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port)
+            self.pid = os.getpid()
+        return self.conn
+
+    def close_connection(self):
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+
+    def convert(self, text, source, target):
+        payload = {"text": text, "from": source, "to": target}
+        body = orjson.dumps(payload) if orjson else json.dumps(payload)
+        headers = {"Content-Type": "application/json", "Accept": "text/plain"}
+        # retry once in case the server closed an idle keep-alive connection
+        for attempt in (1, 2):
+            conn = self.connection()
+            try:
+                conn.request("POST", "/", body, headers)
+                response = conn.getresponse()
+                break
+            except (http.client.HTTPException, OSError):
+                self.close_connection()
+                if attempt == 2:
+                    raise
+        if response.status != 200:
+            response.read()
+            raise OSError(f"pandoc server returned {response.status}")
+        return response.read().decode()
+
+    def stop(self):
+        self.close_connection()
+        if self.proc:
+            self.proc.terminate()
+            self.proc = None
+
+
+# set in main. inherited by worker processes.
+server = None
+
+
+def to_html(doc):
+    """ write a pandoc doc as html, via the server when it is running """
+    if server:
+        return server.convert(pandoc.write(doc, format="json"), "json", "html")
+    return pandoc.write(doc, format="html")
+
+
+def to_markdown(doc):
+    """ write a pandoc doc as markdown, via the server when it is running """
+    if server:
+        return server.convert(pandoc.write(doc, format="json"), "json", "markdown")
+    return pandoc.write(doc)
+
+
+# marks metadata values deferred for batch rendering
+deferred = object()
+
+# characters pandoc's markdown writer passes through unescaped. quotes are
+# excluded because the writer escapes them for its smart extension.
+safe_inline_re = re.compile(r"[A-Za-z0-9 ,.:;?!()]*$")
+# starts the writer would escape or re-mark (lists, quotes, headings)
+unsafe_start_re = re.compile(r"[-+*>#]|\d+[.)]")
+
+
+def inlines_to_markdown(inlines):
+    """ render Str/Space inlines directly, as the markdown writer would.
+    returns None when any inline could need pandoc's escaping or wrapping """
+    out = []
+    for inline in inlines:
+        if isinstance(inline, Str):
+            if not safe_inline_re.match(inline[0]):
+                return None
+            out.append(inline[0])
+        elif isinstance(inline, Space):
+            out.append(" ")
+        else:
+            return None
+    text = "".join(out)
+    # leave list/quote lookalikes, ellipses (escaped by the writer), stripped
+    # edges and wrap-length text to pandoc
+    if unsafe_start_re.match(text) or "..." in text or text != text.strip() or len(text) > 72:
+        return None
+    return text
+
+placeholder_re = re.compile(r"\{\{(.*?)\}\}", re.DOTALL)
+extend_re = re.compile(r"\{\{\s*extend\s+[\"'](.+?)[\"']\s*\}\}")
+include_re = re.compile(r"\{\{\s*include\s+[\"'](.+?)[\"']\s*\}\}")
+slot_re = re.compile(r"\{\{\s*include\s*\}\}")
+
+
+def substitute(value):
+    """ escape like yatl: values providing .xml() pass through, rest escaped """
+    if hasattr(value, "xml") and callable(value.xml):
+        return str(value.xml())
+    return xmlescape(str(value))
+
+
+class CompiledTemplate:
+    """ a layout that only substitutes variables, compiled once into a python
+    function concatenating literals and substituted values (the same trick
+    jinja uses internally). escapes like yatl so output is identical, but
+    renders without parsing and exec-ing the template each call """
+
+    def __init__(self, source):
+        pieces = []
+        last = 0
+        for match in placeholder_re.finditer(source):
+            code = match.group(1).strip()
+            if code.startswith("="):
+                key = code[1:].strip()
+                if not key.isidentifier():
+                    raise ValueError(f"cannot compile {code}")
+                if source[last : match.start()]:
+                    pieces.append(repr(source[last : match.start()]))
+                pieces.append(f"substitute(context[{key!r}])")
+            elif code.isidentifier():
+                # yatl evaluates a bare name but writes nothing
+                if source[last : match.start()]:
+                    pieces.append(repr(source[last : match.start()]))
+            else:
+                raise ValueError(f"cannot compile {code}")
+            last = match.end()
+        if source[last:] or not pieces:
+            pieces.append(repr(source[last:]))
+        body = "\n        + ".join(pieces)
+        namespace = dict(substitute=substitute)
+        exec(f"def render(context):\n    return (\n        {body}\n    )", namespace)
+        self.render = namespace["render"]
+
+
+def convert(src, mtime=None):
+    """ convert a source file to (html, meta). runs in a worker process.
+
+    results are cached by mtime so rebuilds only pay pandoc for changed files.
+    """
+    if mtime is None:
+        mtime = os.stat(src).st_mtime
+    cachefile = f"{cachedir}/{hashlib.sha1(src.encode()).hexdigest()}.pkl"
+    # docx conversion extracts media as a side effect so cannot be skipped
+    cacheable = not src.endswith(".docx")
+    if cacheable:
+        try:
+            with open(cachefile, "rb") as f:
+                cached_mtime, html, meta = pickle.load(f)
+            if cached_mtime == mtime:
+                return html, meta
+        except Exception:
+            # missing, torn or stale-format cache entries are all just misses
+            pass
+    try:
+        page = Page(src, mtime)
+    except:
+        log.exception(f"unable to parse {src}")
+        return None, None
+    if page.json is not None:
+        # blocks were never materialized; the raw AST goes straight back out
+        html = server.convert(page.json, "json", "html")
+    else:
+        html = to_html(page.pandoc)
+    # the AST can be large; free it before pickling so peak memory stays flat
+    page.pandoc = page.json = None
+    if cacheable:
+        os.makedirs(cachedir, exist_ok=True)
+        # write then rename so an interrupted build cannot leave a torn entry
+        tmpfile = f"{cachefile}.{os.getpid()}.tmp"
+        with open(tmpfile, "wb") as f:
+            pickle.dump((mtime, html, page.meta), f)
+        os.replace(tmpfile, cachefile)
+    return html, page.meta
 
 
 def main():
@@ -25,141 +312,318 @@ def main():
     gcontext["site_url"] = os.environ.get("MAKESITE_URL", "http://localhost:8000/")
     gcontext["current_year"] = datetime.now().year
 
-    # site
-    site = Site(gcontext)
-    site.clear()
-    site.create_menu()
-    cat2metas = site.create_pages()
-    site.create_indexes(cat2metas)
+    # one pandoc process for the whole build rather than one per conversion
+    global server
+    server = PandocServer()
+    if not server.start():
+        log.info("pandoc server unavailable. using one pandoc process per conversion")
+        server = None
+
+    # site. menu comes first as it is part of the state that clear checks.
+    try:
+        site = Site(gcontext)
+        site.create_menu()
+        site.clear()
+        metas = site.create_pages()
+        site.create_indexes(metas)
+    finally:
+        if server:
+            server.stop()
 
 
 class Site:
     def __init__(self, gcontext):
         self.outpath = "_site"
         self.gcontext = gcontext
+        # output dirs already created, so write makes each dir only once
+        self.madedirs = set()
+        # rendered item fragments, shared between category and home indexes
+        self.item_cache = dict()
+        # layout sources read once, in a single directory pass
+        with os.scandir("layout") as it:
+            raw = {
+                entry.name: open(entry.path).read() for entry in it if entry.is_file()
+            }
+        self.layout_hash = hashlib.sha1(
+            "".join(raw[name] for name in sorted(raw)).encode()
+        ).hexdigest()
+        # extend/include are fixed for the build so are resolved once here
+        # rather than re-read and re-parsed by yatl on every render
+        self.layouts = {name: self.merge(name, raw) for name in raw}
+        # any layout that contains only variable substitutions is precompiled
+        # to a plain splice. layouts needing code stay with yatl.
+        for name, source in self.layouts.items():
+            try:
+                self.layouts[name] = CompiledTemplate(source)
+            except ValueError:
+                pass
+
+    def merge(self, name, raw):
+        """ inline a layout's extend and includes, returning plain source """
+        source = raw[name]
+        match = extend_re.search(source)
+        if match:
+            body = extend_re.sub("", source, count=1)
+            parent = self.merge(os.path.basename(match.group(1)), raw)
+            source = slot_re.sub(lambda _: body, parent, count=1)
+        return include_re.sub(
+            lambda m: self.merge(os.path.basename(m.group(1)), raw), source
+        )
+
+    def site_hash(self):
+        """ identifies everything besides its source that shapes a page """
+        state = self.layout_hash + self.gcontext["menu"].xml()
+        state += "".join(
+            str(v) for k, v in sorted(self.gcontext.items()) if k != "menu"
+        )
+        return hashlib.sha1(state.encode()).hexdigest()
 
     def clear(self):
+        """ reset the site folder. existing outputs are kept for incremental
+        reuse unless the layouts, menu or global context changed """
+        self.fresh = False
+        hashfile = f"{cachedir}/site_hash"
+        site_hash = self.site_hash()
+        try:
+            self.fresh = open(hashfile).read() == site_hash
+        except OSError:
+            pass
+        if not self.fresh:
+            if os.path.isdir(self.outpath):
+                shutil.rmtree(self.outpath)
+            os.makedirs(cachedir, exist_ok=True)
+            with open(hashfile, "w") as f:
+                f.write(site_hash)
         if os.path.isdir(self.outpath):
-            shutil.rmtree(self.outpath)
-        shutil.copytree("static", self.outpath)
+            # refresh static files without wiping generated pages. only files
+            # whose mtime or size differ are copied.
+            for entry in walk_content("static"):
+                dst = entry.path.replace("static/", f"{self.outpath}/", 1)
+                stat = entry.stat()
+                try:
+                    dstat = os.stat(dst)
+                    if dstat.st_mtime >= stat.st_mtime and dstat.st_size == stat.st_size:
+                        continue
+                except OSError:
+                    pass
+                self.makedir(os.path.dirname(dst))
+                shutil.copy(entry.path, dst)
+        else:
+            shutil.copytree("static", self.outpath)
 
     def create_menu(self):
-        cats = [os.path.basename(f) for f in glob("content/*") if os.path.isdir(f)]
+        # one directory pass classifies categories and root pages
+        with os.scandir("content") as it:
+            entries = sorted(it, key=lambda e: e.name)
+        cats = [e.name for e in entries if e.is_dir(follow_symlinks=False)]
         pages = [
-            os.path.basename(os.path.splitext(f)[0])
-            for f in glob("content/*")
-            if os.path.isfile(f) and is_pandoc(f) and not f.startswith("index.")
+            os.path.splitext(e.name)[0]
+            for e in entries
+            if e.is_file() and is_pandoc(e.name) and not e.name.startswith("index.")
         ]
 
-        menu = [f"<a href={cat}>{cat.capitalize()}</a>" for cat in cats] + [
-            f"<a href={page}.html>{page.capitalize()}</a>" for page in pages
-        ]
-        menu = "\n".join(menu)
+        menu = "\n".join(
+            itertools.chain(
+                (f'<a href="{cat}">{cat.capitalize()}</a>' for cat in cats),
+                (f'<a href="{page}.html">{page.capitalize()}</a>' for page in pages),
+            )
+        )
         self.gcontext.update(menu=XML(menu))
 
     def create_pages(self):
-        """ create the content pages. return index by category in format dict(cat=[meta, ...])"""
-        cat2metas = defaultdict(list)
-        for src in tqdm(
-            [f for f in glob("content/**", recursive=True) if os.path.isfile(f)]
-        ):
+        """ create the content pages. return the metas of all category pages """
+        metas = []
+        pages = []
+        copies = []
+        for entry in walk_content("content"):
+            src = entry.path
             # copy media files etc..
-            if os.path.splitext(src)[-1] and not is_pandoc(src):
+            ext = os.path.splitext(src)[-1]
+            if ext and ext not in pandoc_exts():
                 dst = src.replace("content/", f"{self.outpath}/")
-                os.makedirs(os.path.dirname(dst), exist_ok=True)
-                shutil.copy(src, dst)
-                continue
-
-            # convert pages
-            try:
-                page = Page(src)
-            except:
-                log.exception(f"unable to parse {src}")
+                if self.fresh:
+                    # copy newer than source and site state unchanged => skip
+                    try:
+                        if os.stat(dst).st_mtime >= entry.stat().st_mtime:
+                            continue
+                    except OSError:
+                        pass
+                self.makedir(os.path.dirname(dst))
+                copies.append((src, dst))
                 continue
-
-            html = pandoc.write(page.pandoc, format="html")
-            context = dict(self.gcontext, content=XML(html), **page.meta)
-            if os.path.dirname(src) == "content":
-                # root pages
-                output = self.render("page.html", context)
-            else:
-                # category pages use post layout and add meta to category index.
-                output = self.render("post.html", context)
-                cat2metas[page.meta["category"]].append(page.meta)
-            self.write(output, page.meta["relpath"])
-
-        # move extracted media files
-        os.makedirs("media", exist_ok=True)
-        shutil.move("media", "_site/media")
-
-        return cat2metas
-
-    def create_indexes(self, cat2metas):
+            pages.append((src, entry.stat().st_mtime))
+
+        # media copies are io bound and independent of the conversions, so a
+        # thread pool overlaps them with the pandoc work below. copyfile takes
+        # the sendfile fast path; mode bits are dropped, which nothing reads.
+        copier = ThreadPoolExecutor(max_workers=8)
+        copying = [copier.submit(shutil.copyfile, src, dst) for src, dst in copies]
+
+        # deferred with the other heavy imports; only the page loop needs it
+        from tqdm.auto import tqdm
+
+        # convert pages in parallel. pandoc dominates so this scales with cores.
+        # chunksize batches tasks so small pages do not pay an IPC round trip each.
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as ex:
+            results = ex.map(convert, *zip(*pages), chunksize=4) if pages else ()
+            for (src, mtime), (html, meta) in tqdm(zip(pages, results), total=len(pages)):
+                if html is None:
+                    continue
+                if self.fresh:
+                    # output newer than source and site state unchanged => skip
+                    try:
+                        if os.stat(f"{self.outpath}/{meta['relpath']}").st_mtime >= mtime:
+                            if os.path.dirname(src) != "content":
+                                metas.append(meta)
+                            continue
+                    except OSError:
+                        pass
+                context = ChainMap(dict(content=XML(html)), meta, self.gcontext)
+                if os.path.dirname(src) == "content":
+                    # root pages
+                    output = self.render("page.html", context)
+                else:
+                    # category pages use post layout and add meta to category index.
+                    output = self.render("post.html", context)
+                    metas.append(meta)
+                self.write(output, meta["relpath"])
+
+        # surface any copy failure before the media merge
+        for future in copying:
+            future.result()
+        copier.shutdown()
+
+        # merge extracted media into the site. renaming moves each file
+        # without copying its bytes, unlike copytree.
+        if os.path.isdir("media"):
+            for entry in walk_content("media"):
+                dst = f"{self.outpath}/{entry.path}"
+                self.makedir(os.path.dirname(dst))
+                os.replace(entry.path, dst)
+            shutil.rmtree("media")
+
+        return metas
+
+    def create_indexes(self, metas):
         """ create category index pages and home index """
-        for category, metas in cat2metas.items():
-            metas = sorted(metas, key=lambda meta: meta["date"], reverse=True)
-            self.create_index(
-                metas, category, **dict(title=category.capitalize(), **self.gcontext),
+        # one sort covers every category index, newest first within category
+        ordered = sorted(metas, key=operator.itemgetter("category", "date"), reverse=True)
+        tasks = [
+            (
+                list(group),
+                category,
+                ChainMap(dict(title=category.capitalize()), self.gcontext),
             )
+            for category, group in itertools.groupby(
+                ordered, key=operator.itemgetter("category")
+            )
+        ]
 
-        # home index page
+        # home index page. nlargest keeps the top n without a full sort.
         nposts = 10
-        metas = list(itertools.chain(*cat2metas.values()))
-        metas = sorted(metas, key=lambda meta: meta["date"], reverse=True)[:nposts]
-        self.create_index(
-            metas, "", **dict(title=f"Most recent {nposts} posts", **self.gcontext)
+        recent = heapq.nlargest(nposts, metas, key=operator.itemgetter("date"))
+        tasks.append(
+            (recent, "", ChainMap(dict(title=f"Most recent {nposts} posts"), self.gcontext))
         )
 
-    def create_index(self, metas, path, **context):
+        # each index is independent so rendering and file writes overlap
+        with ThreadPoolExecutor(max_workers=min(8, len(tasks))) as ex:
+            list(ex.map(lambda task: self.create_index(*task), tasks))
+
+    def create_index(self, metas, path, context):
         """Generate index page"""
         rsspath = "/".join([path, "rss.xml"])
 
-        # write index
-        items = [self.render("item.html", dict(context, **meta)) for meta in metas]
-        context = dict(context, content=XML("".join(items)), rsspath=rsspath)
-        output = self.render("list.html", context)
+        # write index. ChainMap is a view so avoids a dict copy per item.
+        items = [self.render_item("item.html", meta, context) for meta in metas]
+        page = ChainMap(dict(content=XML("".join(items)), rsspath=rsspath), context)
+        output = self.render("list.html", page)
         self.write(output, "/".join([path, "index.html"]))
 
         # write rss
-        items = [self.render("item.xml", dict(context, **meta)) for meta in metas]
-        context = dict(context, content=XML("".join(items)), rsspath=rsspath)
-        output = self.render("feed.xml", context)
+        items = [self.render_item("item.xml", meta, context) for meta in metas]
+        feed = ChainMap(dict(content=XML("".join(items)), rsspath=rsspath), context)
+        output = self.render("feed.xml", feed)
         self.write(output, rsspath)
 
+    def render_item(self, template, meta, context):
+        """ render an index item fragment, memoized by relpath. the fragment
+        only reads the meta and constant globals, so a post appearing on both
+        its category index and the home index renders once """
+        key = (template, meta["relpath"])
+        if key not in self.item_cache:
+            self.item_cache[key] = self.render(template, ChainMap(meta, context))
+        return self.item_cache[key]
+
+    def makedir(self, dstdir):
+        """ makedirs, skipping directories already created """
+        if dstdir not in self.madedirs:
+            os.makedirs(dstdir, exist_ok=True)
+            self.madedirs.add(dstdir)
+
     def write(self, output, dst):
         """ write file to site """
         dst = f"{self.outpath}/{dst}"
-        log.debug(f"Writing {dst}")
-        os.makedirs(os.path.dirname(dst), exist_ok=True)
-        with open(dst, "w") as f:
-            f.write(output)
+        log.debug("Writing %s", dst)
+        self.makedir(os.path.dirname(dst))
+        # one explicit encode and a binary write skips the TextIOWrapper layer
+        with open(dst, "wb") as f:
+            f.write(output.encode("utf-8"))
 
     def render(self, template, context):
-        return render(filename=f"layout/{template}", context=context)
+        layout = self.layouts[template]
+        if isinstance(layout, CompiledTemplate):
+            return layout.render(context)
+        # yatl executes the template with context as globals so needs a real dict
+        if not isinstance(context, dict):
+            context = dict(context)
+        return render(content=layout, context=context)
 
 
 class Page:
-    def __init__(self, path):
+    def __init__(self, path, mtime=None):
         self.path = path
+        # callers that have already statted the file pass mtime in
+        self.mtime = os.stat(path).st_mtime if mtime is None else mtime
+        # raw AST json, kept when blocks are not materialized on the server path
+        self.json = None
         self.pandoc = self.read()
         self.meta = self.getmeta()
 
     def read(self):
-        options = []
+        load_pandoc()
         if self.path.endswith(".docx"):
+            # media extraction needs the pandoc program
             # example image => "media/blog/xyz.docx/media/image1.jpg"
             relpath = os.path.relpath(self.path, "content")
-            options.extend(["--extract-media", f"media/{relpath}"])
-        return pandoc.read(file=self.path, options=options)
+            options = ["--extract-media", f"media/{relpath}"]
+            return pandoc.read(file=self.path, options=options)
+        if server:
+            fmt = pandoc._ext_to_file_format.get(
+                os.path.splitext(self.path)[-1], "markdown"
+            )
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    text = f.read()
+            except UnicodeDecodeError:
+                # binary formats (odt, epub) cannot go over the text api
+                pass
+            else:
+                self.json = server.convert(text, fmt, "json")
+                # only the meta field is needed in python. dropping the blocks
+                # skips building (and discarding) the whole document tree.
+                docdict = json.loads(self.json)
+                docdict["blocks"] = []
+                return pandoc.read(json.dumps(docdict), format="json")
+        return pandoc.read(file=self.path)
 
     def getmeta(self):
         meta = dict()
 
         # path metadata
         date_title, ext = os.path.splitext(os.path.basename(self.path))
-        last_modified = os.stat(self.path).st_mtime
-        last_modified = datetime.fromtimestamp(last_modified).strftime("%Y-%m-%d")
-        match = re.search(r"^(?:(\d\d\d\d-\d\d-\d\d)-)?(.+)$", date_title)
+        last_modified = mtime_date(int(self.mtime))
+        match = date_title_re.match(date_title)
         meta["date"] = match.group(1) or last_modified
         meta["title"] = match.group(2)
         relpath = os.path.relpath(self.path, "content")
@@ -173,27 +637,52 @@ class Page:
             meta.update(docmeta)
         except:
             log.exception(f"unable to decode metadata for {self.path}")
-        meta["rfc_2822_date"] = datetime.strptime(meta["date"], "%Y-%m-%d").strftime(
-            "%a, %d %b %Y %H:%M:%S +0000"
-        )
+        meta["rfc_2822_date"] = rfc_2822(meta["date"])
         meta.setdefault("summary", "")
 
         return meta
 
     def meta2dict(self, meta):
-        """ recursively convert pandoc metadata to dict """
-        if isinstance(meta, (Pandoc, Meta, MetaMap)):
-            return self.meta2dict(meta[0])
+        """ convert pandoc metadata to dict. MetaInlines values are rendered with
+        one pandoc.write for the whole page rather than one per key """
+        values = []
+        skeleton = self.meta2skeleton(meta, values)
+        if not values:
+            return skeleton
+        doc = Pandoc(Meta({}), [Para(value) for value in values])
+        parts = to_markdown(doc).rstrip("\n").split("\n\n")
+        if len(parts) != len(values):
+            # a value rendered with a blank line. fall back to one write per value
+            parts = [to_markdown([Para(value)]).rstrip() for value in values]
+        return self.fill(skeleton, iter(parts))
+
+    def meta2skeleton(self, meta, values):
+        """ recursively convert pandoc metadata to dict, deferring MetaInlines """
+        if isinstance(meta, meta_containers):
+            return self.meta2skeleton(meta[0], values)
         elif isinstance(meta, dict):
-            return {k: self.meta2dict(v) for k, v in meta.items()}
+            return {k: self.meta2skeleton(v, values) for k, v in meta.items()}
         elif isinstance(meta, MetaInlines):
-            doc = [Para(meta[0])]
-            return pandoc.write(doc).rstrip()
+            if not meta[0]:
+                return ""
+            text = inlines_to_markdown(meta[0])
+            if text is not None:
+                return text
+            values.append(meta[0])
+            return deferred
         elif isinstance(meta, MetaValue):
             return meta[0]
 
         raise Exception("Metadata type not found")
 
+    def fill(self, node, parts):
+        """ replace deferred markers with the batch-rendered values """
+        if isinstance(node, dict):
+            return {k: self.fill(v, parts) for k, v in node.items()}
+        if node is deferred:
+            return next(parts)
+        return node
+
 
 if __name__ == "__main__":
     main()